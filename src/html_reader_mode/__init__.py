@@ -1,3 +1,3 @@
-from .html_reader_mode import HTMLReaderMode
+from .html_reader_mode import Block, HTMLReaderMode
 
-__all__ = ["HTMLReaderMode"]
+__all__ = ["Block", "HTMLReaderMode"]
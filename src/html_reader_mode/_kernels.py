@@ -0,0 +1,82 @@
+"""Numba-compiled helpers, imported on first use only when numba is installed"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def _is_space(c: int) -> bool:
+    # Same code points as str.isspace, so counts match str.split
+    return (
+        (9 <= c <= 13)
+        or (28 <= c <= 32)
+        or c == 0x85
+        or c == 0xA0
+        or c == 0x1680
+        or (0x2000 <= c <= 0x200A)
+        or c == 0x2028
+        or c == 0x2029
+        or c == 0x202F
+        or c == 0x205F
+        or c == 0x3000
+    )
+
+
+@njit(cache=True)
+def _count_words_batch(buf, offsets):
+    counts = np.zeros(offsets.shape[0] - 1, dtype=np.int64)
+    for i in range(counts.shape[0]):
+        in_word = False
+        for j in range(offsets[i], offsets[i + 1]):
+            is_space = _is_space(buf[j])
+            if not is_space and not in_word:
+                counts[i] += 1
+            in_word = not is_space
+    return counts
+
+
+@njit(cache=True, nogil=True)
+def classify(
+    num_words,
+    link_density,
+    terminating,
+    cutoff,
+    minimum_cutoff_threshold,
+    minimum_block_words,
+    maximum_block_link_density,
+    maximum_preceding_block_link_density,
+):
+    """Return the content mask for blocks described by parallel arrays
+
+    Compiled version of html_reader_mode._classify_arrays, in a single pass
+    that releases the GIL.
+    """
+    n = num_words.shape[0]
+    is_content = np.zeros(n, dtype=np.bool_)
+    content_words_so_far = 0
+    for i in range(n):
+        if cutoff[i] and content_words_so_far > minimum_cutoff_threshold:
+            break
+        long = num_words[i] > minimum_block_words
+        next_long = i + 1 < n and num_words[i + 1] > minimum_block_words
+        prev_long = (
+            i > 0
+            and num_words[i - 1] > minimum_block_words
+            and link_density[i - 1] <= maximum_preceding_block_link_density
+        )
+        if (
+            not terminating[i]
+            and link_density[i] <= maximum_block_link_density
+            and (long or next_long or prev_long)
+        ):
+            is_content[i] = True
+            content_words_so_far += num_words[i]
+    return is_content
+
+
+def count_words(texts: list[str], joined: str) -> list[int]:
+    """Count the words in each of texts, where joined is "".join(texts)"""
+    buf = np.frombuffer(joined.encode("utf-32-le"), dtype=np.uint32)
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in texts], out=offsets[1:])
+    return _count_words_batch(buf, offsets).tolist()
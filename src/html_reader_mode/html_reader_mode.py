@@ -1,28 +1,134 @@
-import re
-from typing import Optional
+from __future__ import annotations
 
-from bs4 import BeautifulSoup, NavigableString, Tag, PageElement, Comment
+import functools
+from itertools import compress
+from types import ModuleType
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Optional
+
+if TYPE_CHECKING:
+    import numpy as np
+    from lxml import etree
+
+# Below this many characters per block, str.split beats the overhead of
+# handing the text to the compiled word counter
+_KERNEL_MIN_CHARS = 2048
+
+
+@functools.lru_cache(maxsize=None)
+def _load_kernels() -> Optional[ModuleType]:
+    """Import the Numba kernels on first use, or None if numba is missing"""
+    try:
+        from . import _kernels
+    except ImportError:  # the compiled kernels are an optional speedup
+        return None
+    return _kernels
+
+
+def _loaded_kernels() -> Optional[ModuleType]:
+    """The Numba kernels if they have already been imported, otherwise None
+
+    Classifying blocks in compiled code saves microseconds per document, far
+    less than importing numba costs, so it only uses kernels that something
+    else (long text blocks) has already paid to load.
+    """
+    return _load_kernels() if _load_kernels.cache_info().currsize else None
+
+
+def _count_words(texts: list[str], joined: str) -> list[int]:
+    """Count the words in each of texts, where joined is "".join(texts)"""
+    if len(joined) >= _KERNEL_MIN_CHARS:
+        kernels = _load_kernels()
+        if kernels is not None:
+            return kernels.count_words(texts, joined)
+    return [len(text.split()) for text in texts]
+
+
+def _classify_arrays(
+    num_words: np.ndarray,
+    link_density: np.ndarray,
+    terminating: np.ndarray,
+    cutoff: np.ndarray,
+    minimum_cutoff_threshold: int,
+    minimum_block_words: int,
+    maximum_block_link_density: float,
+    maximum_preceding_block_link_density: float,
+) -> np.ndarray:
+    """Return the content mask for blocks described by parallel arrays
+
+    This is the NumPy version of _kernels.classify and must give the same result.
+    """
+    import numpy as np
+
+    # A block is content when its own link density is low enough and it is
+    # long, is followed by a long block, or is preceded by a long block whose
+    # link density is low enough. The neighbour rules are applied through views
+    # shifted by one block, so the first block simply has no predecessor and
+    # the last no successor.
+    long = num_words > minimum_block_words
+    is_content = long.copy()
+    is_content[:-1] |= long[1:]
+    is_content[1:] |= long[:-1] & (
+        link_density[:-1] <= maximum_preceding_block_link_density
+    )
+    is_content &= link_density <= maximum_block_link_density
+    is_content &= ~terminating
+
+    # Everything from the first cutoff keyword that follows enough content
+    # onwards is excluded; before it, content is decided purely locally
+    content_words = np.where(is_content, num_words, 0)
+    content_words_so_far = np.cumsum(content_words) - content_words
+    is_content &= ~np.logical_or.accumulate(
+        cutoff & (content_words_so_far > minimum_cutoff_threshold)
+    )
+    return is_content
+
+
+class Block(NamedTuple):
+    """A content block returned by HTMLReaderMode.sanitize_blocks"""
+
+    tag: str
+    content: str
+
+    def to_dict(self) -> dict[str, str]:
+        return {"tag": self.tag, "content": self.content}
 
 
 class TextBlock:
+    __slots__ = ("text", "num_words", "num_linked_words", "link_density", "tag_name")
+
     def __init__(
         self,
-        text_builder: list[str],
+        text: str,
         num_words: int,
         num_linked_words: int,
-        tag_level: int,
         tag_name: str = "p",
     ):
-        self.text: str = "".join(text_builder).strip()
+        self.text: str = text
         self.num_words: int = num_words
         self.num_linked_words: int = num_linked_words
         self.link_density: float = (
             num_linked_words / num_words if num_words > 0 else 0.0
         )
-        self.tag_level: int = tag_level
         self.tag_name: str = tag_name
-        self.is_content: bool = False
-        self.to_be_excluded: bool = False
+
+
+# Shared stand-in for short blocks made up entirely of link text. Such a block
+# can never be content itself, and all its neighbours look at is that it is
+# short with a link density of 1.0, so one instance serves for all of them.
+_LINK_ONLY_BLOCK = TextBlock("", 1, 1)
+
+# The reader each process pool worker of sanitize_many() sanitizes with, sent
+# to the worker once when it starts rather than along with every document
+_worker_reader: Optional[HTMLReaderMode] = None
+
+
+def _init_worker(reader: HTMLReaderMode) -> None:
+    global _worker_reader
+    _worker_reader = reader
+
+
+def _sanitize_in_worker(html: str) -> list[dict[str, str]]:
+    return _worker_reader.sanitize(html)
 
 
 class HTMLReaderMode:
@@ -93,10 +199,11 @@ class HTMLReaderMode:
         self.minimum_block_words = minimum_block_words
         self.maximum_preceding_block_link_density = maximum_preceding_block_link_density
         self.maximum_block_link_density = maximum_block_link_density
-        self.block_tags = (
+        # Copy so that changing one reader's tags never leaks into the defaults
+        self.block_tags = set(
             block_tags if block_tags is not None else self.DEFAULT_BLOCK_TAGS
         )
-        self.script_tags = (
+        self.script_tags = set(
             script_tags if script_tags is not None else self.DEFAULT_SCRIPT_TAGS
         )
         self.terminating_keywords = (
@@ -110,164 +217,272 @@ class HTMLReaderMode:
             else self.DEFAULT_CUTOFF_KEYWORDS
         )
 
+    @classmethod
+    def get(
+        cls,
+        minimum_cutoff_threshold: int = 100,
+        minimum_block_words: int = 16,
+        maximum_preceding_block_link_density: float = 0.5,
+        maximum_block_link_density: float = 0.33,
+        block_tags: Optional[set[str]] = None,
+        script_tags: Optional[set[str]] = None,
+        terminating_keywords: Optional[list[str]] = None,
+        cutoff_keywords: Optional[list[str]] = None,
+    ) -> "HTMLReaderMode":
+        """Return a shared HTMLReaderMode for the given parameters
+
+        Instances are cached on their parameters, so code that handles many
+        documents with the same settings can call this instead of constructing
+        a new reader (and rebuilding its keyword lookups) per document. An
+        instance can be reused for any number of sanitize() calls; shared
+        instances must not be modified.
+
+        Args: see __init__
+        """
+        return cls._get_cached(
+            minimum_cutoff_threshold,
+            minimum_block_words,
+            maximum_preceding_block_link_density,
+            maximum_block_link_density,
+            frozenset(block_tags) if block_tags is not None else None,
+            frozenset(script_tags) if script_tags is not None else None,
+            tuple(terminating_keywords) if terminating_keywords is not None else None,
+            tuple(cutoff_keywords) if cutoff_keywords is not None else None,
+        )
+
+    @classmethod
+    @functools.lru_cache(maxsize=32)
+    def _get_cached(cls, *args) -> "HTMLReaderMode":
+        return cls(*args)
+
+    @property
+    def terminating_keywords(self) -> tuple[str, ...]:
+        return self._terminating_keywords
+
+    @terminating_keywords.setter
+    def terminating_keywords(self, keywords: Iterable[str]) -> None:
+        # Stored as a tuple so in-place changes fail loudly instead of being
+        # missed by the lookup; assign a new sequence to change the keywords
+        self._terminating_keywords = tuple(keywords)
+        self._terminating_set = frozenset(k.lower() for k in self._terminating_keywords)
+
+    @property
+    def cutoff_keywords(self) -> tuple[str, ...]:
+        return self._cutoff_keywords
+
+    @cutoff_keywords.setter
+    def cutoff_keywords(self, keywords: Iterable[str]) -> None:
+        self._cutoff_keywords = tuple(keywords)
+        self._cutoff_set = frozenset(k.lower() for k in self._cutoff_keywords)
+
     def sanitize(self, html: str) -> list[dict[str, str]]:
+        return [
+            {"tag": b.tag_name, "content": b.text} for b in self._content_blocks(html)
+        ]
+
+    def sanitize_blocks(self, html: str) -> list[Block]:
+        """Like sanitize(), but return each content block as a Block tuple
+
+        A tuple is considerably smaller than a dict per block, which adds up
+        when many documents are kept in memory; Block.to_dict() converts back.
+        """
+        return [Block(b.tag_name, b.text) for b in self._content_blocks(html)]
+
+    def _content_blocks(self, html: str) -> list[TextBlock]:
         if not html:
             return []
-        soup = BeautifulSoup(html, "html.parser")
+        from lxml import etree
 
-        for script in soup(self.script_tags):
-            script.decompose()
+        try:
+            document = etree.HTML(html)
+        except ValueError:
+            # str input carrying an XML encoding declaration has to be bytes
+            document = etree.HTML(html.encode("utf-8"))
+        if document is None:
+            # Nothing to parse, e.g. only whitespace or comments
+            return []
 
-        root = soup.body if soup.body else soup
+        body = document.find("body")
+        root = body if body is not None else document
         blocks: list[TextBlock] = self._linearize_dom(root)
-        self._classify_blocks(blocks)
+        is_content = self._classify_blocks(blocks)
+        return list(compress(blocks, is_content.tolist()))
 
-        return [{"tag": b.tag_name, "content": b.text} for b in blocks if b.is_content]
+    def sanitize_many(
+        self,
+        htmls: Iterable[str],
+        workers: Optional[int] = None,
+        use_processes: bool = False,
+    ) -> list[list[dict[str, str]]]:
+        """Sanitize several documents concurrently
 
-    def _linearize_dom(self, root: PageElement) -> list[TextBlock]:
+        sanitize() does not modify the reader, so one instance can be shared by
+        all workers. Threads are used by default since lxml releases the GIL
+        while parsing; pass use_processes=True to also run the pure Python
+        parts of sanitize() in parallel. The reader is then sent to each worker
+        process once, but every document and result still has to be sent
+        between processes, in batches of several documents.
+
+        Args:
+            htmls (Iterable[str]): HTML documents
+            workers (Optional[int]): maximum number of workers, defaults to the
+                executor's own default
+            use_processes (bool): use a process pool instead of a thread pool
+
+        Returns:
+            list[list[dict[str, str]]]: the result of sanitize() for each document,
+                in the same order as htmls
+        """
+        import os
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        if not use_processes:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(self.sanitize, htmls))
+
+        # Same heuristic as multiprocessing.Pool.map: about four batches per
+        # worker keeps them busy without a round trip per document
+        htmls = list(htmls)
+        num_workers = workers or os.cpu_count() or 1
+        chunksize = max(1, -(-len(htmls) // (num_workers * 4)))
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(self,)
+        ) as executor:
+            return list(executor.map(_sanitize_in_worker, htmls, chunksize=chunksize))
+
+    def _linearize_dom(self, root: etree._Element) -> list[TextBlock]:
         blocks: list[TextBlock] = []
 
         current_text: list[str] = []
-        current_num_words: int = 0
-        current_num_linked_words: int = 0
-
-        def flush_block(tag_level: int, tag_name: str) -> None:
-            nonlocal current_text, current_num_words, current_num_linked_words
-            if current_text:
-                text_content = "".join(current_text).strip()
-                if text_content:
-                    blocks.append(
-                        TextBlock(
-                            current_text,
-                            current_num_words,
-                            current_num_linked_words,
-                            tag_level,
-                            tag_name,
-                        )
-                    )
-            current_text = []
-            current_num_words = 0
-            current_num_linked_words = 0
-
-        def count_words(text: str) -> int:
-            return len(text.split())
+        current_linked: list[int] = []
 
-        def traverse(
-            node: PageElement, depth: int, in_link: bool, container_tag: str
-        ) -> None:
-            nonlocal current_num_words, current_num_linked_words
+        # Link-only blocks can only become content if a link density of 1.0
+        # is allowed, and they still have to be kept when they are keywords
+        share_link_only = self.maximum_block_link_density < 1.0
+        minimum_block_words = self.minimum_block_words
+        terminating_set = self._terminating_set
 
-            if isinstance(node, Comment):
+        def flush_block(tag_name: str) -> None:
+            nonlocal current_text, current_linked
+            # add_text only collects nodes with non-whitespace content, so any
+            # collected text makes a non-empty block and needs joining just once
+            if not current_text:
                 return
 
-            if isinstance(node, NavigableString):
-                text = str(node)
-                if not text.strip():
-                    return
-                current_text.append(text)
-                words = count_words(text)
-                current_num_words += words
-                if in_link:
-                    current_num_linked_words += words
-            elif isinstance(node, Tag):
-                is_block = node.name in self.block_tags
-                is_link = (
-                    node.name == "a"
-                    and hasattr(node, "href")
-                    and node["href"].startswith("http")
+            joined = "".join(current_text)
+            text_content = joined.strip()
+            word_counts = _count_words(current_text, joined)
+            num_words = sum(word_counts)
+            num_linked_words = (
+                sum([word_counts[i] for i in current_linked]) if current_linked else 0
+            )
+            if (
+                share_link_only
+                and num_linked_words == num_words
+                and num_words < minimum_block_words
+                and text_content.lower() not in terminating_set
+            ):
+                blocks.append(_LINK_ONLY_BLOCK)
+            else:
+                blocks.append(
+                    TextBlock(text_content, num_words, num_linked_words, tag_name)
                 )
+            current_text = []
+            current_linked = []
+
+        def add_text(text: Optional[str]) -> None:
+            # isspace answers the same question as strip() without copying
+            if not text or text.isspace():
+                return
+            if link_depth:
+                current_linked.append(len(current_text))
+            current_text.append(text)
+
+        def is_link(element: etree._Element) -> bool:
+            return element.tag == "a" and element.get("href", "").startswith("http")
 
-                next_container_tag = node.name if is_block else container_tag
+        block_tags = self.block_tags
+        script_tags = self.script_tags
+        container_tags: list[str] = ["p"]
+        link_depth = 0
 
-                if is_block:
-                    flush_block(depth, container_tag)
+        # Explicit stack of (element, closing) pairs: each element is pushed
+        # once to open it and once more, beneath its children, to close it.
+        stack: list[tuple[etree._Element, bool]] = [(root, False)]
+        while stack:
+            element, closing = stack.pop()
+            tag = element.tag
 
-                for child in node.children:
-                    traverse(child, depth + 1, in_link or is_link, next_container_tag)
+            if closing:
+                if is_link(element):
+                    link_depth -= 1
+                if tag in block_tags:
+                    flush_block(tag)
+                    container_tags.pop()
+                if element is not root:
+                    add_text(element.tail)
+                continue
+
+            # Comments, processing instructions and script-like elements
+            # contribute nothing themselves, but the text after them does
+            if not isinstance(tag, str) or tag in script_tags:
+                add_text(element.tail)
+                continue
 
-                if is_block:
-                    flush_block(depth, next_container_tag)
+            if tag in block_tags:
+                flush_block(container_tags[-1])
+                container_tags.append(tag)
+            if is_link(element):
+                link_depth += 1
+            add_text(element.text)
 
-        traverse(root, 0, False, "p")
-        flush_block(0, "p")
+            stack.append((element, True))
+            stack.extend((child, False) for child in reversed(element))
+
+        flush_block("p")
         return blocks
 
-    def _classify_blocks(self, blocks: list[TextBlock]) -> None:
-        if not blocks:
-            return
-        terminating_pattern = f"^({'|'.join(self.terminating_keywords)})$"
-        cutoff_pattern = f"^({'|'.join(self.cutoff_keywords)})$"
-        terminating_regex = re.compile(terminating_pattern, re.IGNORECASE)
-        cutoff_regex = re.compile(cutoff_pattern, re.IGNORECASE)
-
-        cutoff = False
-        content_words_so_far = 0
-
-        for i in range(len(blocks)):
-            prev_block: Optional[TextBlock] = blocks[i - 1] if i > 0 else None
-            current_block: TextBlock = blocks[i]
-            next_block: Optional[TextBlock] = (
-                blocks[i + 1] if i < len(blocks) - 1 else None
-            )
+    def _classify_blocks(self, blocks: list[TextBlock]) -> np.ndarray:
+        """Classify blocks as content or boilerplate
 
-            if cutoff:
-                current_block.to_be_excluded = True
-                continue
+        The numeric fields of the blocks are gathered into parallel arrays and
+        keyword matches are turned into masks, so the rules themselves run
+        over plain arrays: in the compiled kernel when it has already been
+        loaded, otherwise as NumPy operations.
 
-            if (
-                terminating_regex.search(current_block.text)
-                and current_block.num_words < self.minimum_block_words
-            ):
-                current_block.to_be_excluded = True
-                if (
-                    cutoff_regex.search(current_block.text)
-                    and content_words_so_far > self.minimum_cutoff_threshold
-                ):
-                    cutoff = True
-                    current_block.is_content = False
-                    continue
-
-            if current_block.to_be_excluded:
-                current_block.is_content = False
-                continue
+        Returns:
+            np.ndarray: boolean mask, True for blocks that are content
+        """
+        import numpy as np
 
-            is_content = False
-            if current_block.link_density <= self.maximum_block_link_density:
-                if (
-                    prev_block is None
-                    or prev_block.link_density
-                    <= self.maximum_preceding_block_link_density
-                ):
-                    if current_block.num_words <= self.minimum_block_words:
-                        if (
-                            next_block is None
-                            or next_block.num_words <= self.minimum_block_words
-                        ):
-                            if (
-                                prev_block is None
-                                or prev_block.num_words <= self.minimum_block_words
-                            ):
-                                is_content = False
-                            else:
-                                is_content = True
-                        else:
-                            is_content = True
-                    else:
-                        is_content = True
-                else:
-                    if current_block.num_words <= self.minimum_block_words:
-                        if (
-                            next_block is None
-                            or next_block.num_words <= self.minimum_block_words
-                        ):
-                            is_content = False
-                        else:
-                            is_content = True
-                    else:
-                        is_content = True
-            else:
-                is_content = False
+        n = len(blocks)
+        if not n:
+            return np.zeros(0, dtype=bool)
+
+        num_words = np.fromiter((b.num_words for b in blocks), dtype=np.int64, count=n)
+        link_density = np.fromiter(
+            (b.link_density for b in blocks), dtype=np.float64, count=n
+        )
 
-            current_block.is_content = is_content
-            if is_content:
-                content_words_so_far += current_block.num_words
+        # Keywords must match the whole (already stripped) block text, so
+        # only short blocks need to be looked up at all
+        terminating = np.zeros(n, dtype=bool)
+        cutoff = np.zeros(n, dtype=bool)
+        for i in np.flatnonzero(num_words < self.minimum_block_words).tolist():
+            block_text = blocks[i].text.lower()
+            if block_text in self._terminating_set:
+                terminating[i] = True
+                cutoff[i] = block_text in self._cutoff_set
+
+        kernels = _loaded_kernels()
+        classify = kernels.classify if kernels is not None else _classify_arrays
+        return classify(
+            num_words,
+            link_density,
+            terminating,
+            cutoff,
+            self.minimum_cutoff_threshold,
+            self.minimum_block_words,
+            self.maximum_block_link_density,
+            self.maximum_preceding_block_link_density,
+        )
@@ -1,5 +1,14 @@
+import itertools
+import subprocess
+import sys
 import unittest
-from html_reader_mode import HTMLReaderMode
+from html_reader_mode import Block, HTMLReaderMode
+from html_reader_mode.html_reader_mode import (
+    TextBlock,
+    _classify_arrays,
+    _count_words,
+    _load_kernels,
+)
 
 
 class TestHTMLReaderMode(unittest.TestCase):
@@ -64,6 +73,15 @@ class TestHTMLReaderMode(unittest.TestCase):
         self.assertEqual(self.reader_mode.sanitize(""), [])
         self.assertEqual(self.reader_mode.sanitize(None), [])
 
+    def test_sanitize_blocks(self):
+        reader = HTMLReaderMode(minimum_block_words=1)
+        html = "<body><h1>Title</h1><p>Some paragraph text.</p></body>"
+        blocks = reader.sanitize_blocks(html)
+        self.assertEqual(
+            blocks, [Block("h1", "Title"), Block("p", "Some paragraph text.")]
+        )
+        self.assertEqual([b.to_dict() for b in blocks], reader.sanitize(html))
+
     def test_no_body(self):
         reader = HTMLReaderMode(minimum_block_words=1)
         html = "<div><p>Content without body tag.</p></div>"
@@ -130,6 +148,68 @@ class TestHTMLReaderMode(unittest.TestCase):
             any("This content should be cut off" in c["content"] for c in content)
         )
 
+    def test_cutoff_keyword_link(self):
+        reader = HTMLReaderMode(minimum_cutoff_threshold=5, minimum_block_words=4)
+        html = """
+        <body>
+            <p>Start of the article. Valid content. One two three four five six.</p>
+            <h2><a href="http://example.com/#comments">Comments</a></h2>
+            <p>This content should be cut off because it follows the comments.</p>
+        </body>
+        """
+        content = reader.sanitize(html)
+        self.assertTrue(any("Start of the article" in c["content"] for c in content))
+        self.assertFalse(any("should be cut off" in c["content"] for c in content))
+
+    def test_keywords_are_literal(self):
+        reader = HTMLReaderMode(minimum_block_words=2, terminating_keywords=["a.c"])
+        html = """
+        <body>
+            <p>Opening paragraph with enough words to be content.</p>
+            <p>abc</p>
+            <p>a.c</p>
+        </body>
+        """
+        content = reader.sanitize(html)
+        self.assertTrue(any(c["content"] == "abc" for c in content))
+        self.assertFalse(any(c["content"] == "a.c" for c in content))
+
+    def test_large_keyword_list(self):
+        keywords = [f"section {i}" for i in range(1000)] + ["Share This"]
+        reader = HTMLReaderMode(minimum_block_words=3, terminating_keywords=keywords)
+        html = """
+        <body>
+            <p>Opening paragraph with enough words to be content.</p>
+            <p>Section 999</p>
+            <p>share this</p>
+            <p>Section 1000</p>
+            <p>Closing paragraph with enough words to be content.</p>
+        </body>
+        """
+        content = [c["content"] for c in reader.sanitize(html)]
+        self.assertNotIn("Section 999", content)
+        self.assertNotIn("share this", content)
+        self.assertIn("Section 1000", content)
+
+    def test_keywords_reassigned(self):
+        reader = HTMLReaderMode(minimum_block_words=2)
+        html = """
+        <body>
+            <p>Opening paragraph with enough words to be content.</p>
+            <p>Sponsored</p>
+        </body>
+        """
+        content = reader.sanitize(html)
+        self.assertTrue(any(c["content"] == "Sponsored" for c in content))
+
+        reader.terminating_keywords = ["sponsored"]
+        content = reader.sanitize(html)
+        self.assertFalse(any(c["content"] == "Sponsored" for c in content))
+
+        # In-place changes would bypass the lookup, so they must fail loudly
+        with self.assertRaises(AttributeError):
+            reader.terminating_keywords.append("advertisement")
+
     def test_preceding_link_density(self):
         reader = HTMLReaderMode(
             maximum_preceding_block_link_density=0.1, minimum_block_words=16
@@ -176,6 +256,114 @@ class TestHTMLReaderMode(unittest.TestCase):
         )
         self.assertTrue(any("Deeply nested content" in c["content"] for c in content))
 
+    def test_sanitize_many(self):
+        htmls = [
+            "<body><p>First document with plenty of words in its only paragraph.</p></body>",
+            "",
+            "<body><p>Second document, also with enough words to count as content.</p></body>",
+        ]
+        reader = HTMLReaderMode(minimum_block_words=4)
+        expected = [reader.sanitize(html) for html in htmls]
+        self.assertTrue(expected[0] and expected[2])
+        self.assertEqual(reader.sanitize_many(htmls, workers=2), expected)
+        # Enough documents that the process pool sends them in batches
+        self.assertEqual(
+            reader.sanitize_many(
+                (html for html in htmls * 10), workers=2, use_processes=True
+            ),
+            expected * 10,
+        )
+
+    def test_get_shares_instances(self):
+        self.assertIs(HTMLReaderMode.get(), HTMLReaderMode.get())
+        reader = HTMLReaderMode.get(minimum_block_words=4, cutoff_keywords=["end"])
+        self.assertIs(
+            reader, HTMLReaderMode.get(minimum_block_words=4, cutoff_keywords=["end"])
+        )
+        self.assertIsNot(reader, HTMLReaderMode.get())
+        self.assertEqual(reader.minimum_block_words, 4)
+
+    def test_classification_rules(self):
+        reader = HTMLReaderMode(
+            minimum_block_words=10,
+            maximum_block_link_density=0.5,
+            maximum_preceding_block_link_density=0.5,
+        )
+
+        def block(short, high_link_density):
+            num_words = 5 if short else 20
+            return TextBlock("x", num_words, num_words if high_link_density else 0)
+
+        def expected(low_ld, prev_low_ld, short, prev_short, next_short):
+            # The decision tree classification was originally written as
+            if low_ld:
+                if prev_low_ld:
+                    if short:
+                        if next_short:
+                            return not prev_short
+                        return True
+                    return True
+                if short:
+                    return not next_short
+                return True
+            return False
+
+        for combo in itertools.product([False, True], repeat=5):
+            low_ld, prev_low_ld, short, prev_short, next_short = combo
+            blocks = [
+                block(prev_short, not prev_low_ld),
+                block(short, not low_ld),
+                block(next_short, False),
+            ]
+            with self.subTest(combo=combo):
+                self.assertEqual(
+                    bool(reader._classify_blocks(blocks)[1]), expected(*combo)
+                )
+
+    @unittest.skipIf(_load_kernels() is None, "numba is not installed")
+    def test_classify_kernel_matches_arrays(self):
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            n = int(rng.integers(1, 40))
+            terminating = rng.random(n) < 0.2
+            args = (
+                rng.integers(0, 30, n),
+                rng.random(n),
+                terminating,
+                terminating & (rng.random(n) < 0.5),
+                int(rng.integers(0, 60)),
+                int(rng.integers(1, 20)),
+                float(rng.random()),
+                float(rng.random()),
+            )
+            np.testing.assert_array_equal(
+                _load_kernels().classify(*args), _classify_arrays(*args)
+            )
+
+    def test_small_document_does_not_import_numba(self):
+        # Run in a fresh interpreter since this module has already loaded them
+        code = (
+            "import sys; from html_reader_mode import HTMLReaderMode; "
+            "HTMLReaderMode().sanitize('<p>hi</p>'); "
+            "sys.exit('numba' in sys.modules)"
+        )
+        result = subprocess.run([sys.executable, "-c", code])
+        self.assertEqual(result.returncode, 0)
+
+    def test_word_counts_match_split(self):
+        texts = [
+            "word " * 1000,
+            "non\xa0breaking\u3000spaces\u2009and\x1ccontrol\tchars ",
+            "\n  leading and trailing  \n",
+            "zero\u200bwidth",
+            "x",
+        ]
+        self.assertEqual(
+            _count_words(texts, "".join(texts)), [len(t.split()) for t in texts]
+        )
+
 
 if __name__ == "__main__":
     unittest.main()